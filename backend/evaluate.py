@@ -3,90 +3,225 @@ Evaluation script for AI Research Paper Assistant
 Tests: Citation accuracy, summary quality, retrieval relevance
 """
 
+import functools
+import hashlib
 import json
 import re
+import shelve
 from typing import List, Dict
 from collections import Counter
 
+# Compiled once at import - runs on every summary scored
+_CITATION_RE = re.compile(r'\[Page (\d+)\]')
+
+# One case-insensitive pass that short-circuits on the first hit,
+# replacing eight sequential substring searches over a lowercased copy.
+# Deliberately unanchored so e.g. 'methods' and 'findings' still match.
+_STRUCTURE_RE = re.compile(
+    r'objective|method|result|conclusion|finding|approach|study|research',
+    re.IGNORECASE
+)
+
+# Word tokens for the reference-overlap metric; keeps punctuation and
+# citation markers out of the word sets
+_WORD_RE = re.compile(r"[A-Za-z']+")
+
+# Per-result report block, formatted in one format_map call from the
+# flattened metrics instead of a dozen f-strings per test case
+_REPORT_TMPL = (
+    "\nTest: {test_name}\n"
+    "Status: {status}\n"
+    "\nCitation Metrics:\n"
+    "  - Total Citations: {total_citations}\n"
+    "  - Unique Pages: {unique_citations}\n"
+    "  - Citation Density: {citation_density:.2f}\n"
+    "  - Cited Pages: {cited_pages}\n"
+    "\nQuality Metrics:\n"
+    "  - Word Count: {word_count}\n"
+    "  - Sentences: {sentence_count}\n"
+    "  - Avg Sentence Length: {avg_sentence_length:.1f}\n"
+    "  - Has Structure: {has_structure}\n"
+    "\n" + "-" * 60 + "\n"
+)
+
+
+def _prepare(summary: str) -> Dict:
+    """
+    Compute the shared intermediates every evaluator needs, once per summary.
+
+    Citation extraction, sentence/word counting and lowercasing used to be
+    recomputed separately by evaluate_citations and evaluate_summary_quality,
+    so each test case walked the same string several times. str.count is a
+    single C-level scan; the old split('.') built a throwaway list of every
+    sentence fragment just to count them.
+    """
+    return {
+        'cited': [int(p) for p in _CITATION_RE.findall(summary)],
+        'sentence_count': summary.count('.'),
+        'word_count': len(summary.split()),
+    }
+
+
+@functools.lru_cache(maxsize=128)
+def _word_set(text: str) -> frozenset:
+    """Lowercased word tokens of a text. Cached because the same reference
+    summary is typically compared against many generated summaries"""
+    return frozenset(m.group(0).lower() for m in _WORD_RE.finditer(text))
+
+
+@functools.lru_cache(maxsize=1024)
+def _to_frozenset(pages: tuple) -> frozenset:
+    """Ground-truth page lists repeat across test cases - fixed expected/
+    relevant sets get scored against dozens of summaries - so identical
+    tuples share a single frozenset instead of rebuilding it per call"""
+    return frozenset(pages)
+
+
+def _citation_metrics(summary: str, expected_pages, prep: Dict = None) -> Dict:
+    """Pure citation-metric computation shared by Evaluator and the memo cache"""
+    prep = prep or _prepare(summary)
+    cited_pages = prep['cited']
+    sentences = prep['sentence_count']
+
+    # Calculate metrics
+    has_citations = len(cited_pages) > 0
+    cited_set = set(cited_pages)
+    unique_citations = len(cited_set)
+
+    # If expected pages provided, check accuracy
+    accuracy = 0
+    if expected_pages:
+        # C-level set intersection instead of a Python loop of hash probes
+        correct = len(cited_set & _to_frozenset(tuple(expected_pages)))
+        accuracy = correct / len(cited_pages) if cited_pages else 0
+
+    citation_density = len(cited_pages) / sentences if sentences > 0 else 0
+
+    return {
+        'has_citations': has_citations,
+        'total_citations': len(cited_pages),
+        'unique_citations': unique_citations,
+        'citation_accuracy': accuracy,
+        'citation_density': citation_density,
+        'cited_pages': sorted(cited_set)
+    }
+
+
+def _quality_metrics(summary: str, reference: str = None, prep: Dict = None) -> Dict:
+    """Pure quality-metric computation shared by Evaluator and the memo cache"""
+    prep = prep or _prepare(summary)
+    sentence_count = prep['sentence_count']
+    word_count = prep['word_count']
+    avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
+
+    # Check for structure keywords
+    has_structure = _STRUCTURE_RE.search(summary) is not None
+
+    result = {
+        'word_count': word_count,
+        'sentence_count': sentence_count,
+        'avg_sentence_length': avg_sentence_length,
+        'has_structure': has_structure
+    }
+
+    # If reference summary provided, calculate overlap
+    if reference:
+        # Tokenize without lowercasing the whole string first; the
+        # reference's word set is cached across comparisons
+        summary_words = {m.group(0).lower() for m in _WORD_RE.finditer(summary)}
+        reference_words = _word_set(reference)
+
+        overlap = len(summary_words & reference_words)
+        coverage = overlap / len(reference_words) if reference_words else 0
+
+        result['word_overlap'] = overlap
+        result['coverage_score'] = coverage
+
+    return result
+
+
+def _compute_metrics(summary: str, expected_pages: tuple,
+                     reference_summary: str = None) -> tuple:
+    """
+    Full metric computation for one test case.
+
+    Memoization lives in run_test_case, which keys both its in-memory and
+    on-disk caches by a blake2b fingerprint of the inputs - probing a dict
+    with a short digest avoids rehashing the full summary string on every
+    lookup, which is what an lru_cache keyed on the raw arguments would do.
+    """
+    prep = _prepare(summary)
+    return (
+        _citation_metrics(summary, expected_pages, prep=prep),
+        _quality_metrics(summary, reference_summary, prep=prep)
+    )
+
+
+# On-disk memoization so repeated runs (CI, regression sweeps) reuse
+# results across process invocations. Opened lazily on first use.
+_DISK_CACHE_PATH = "./.eval_cache"
+_disk_cache = None
+
+
+def _get_disk_cache():
+    global _disk_cache
+    if _disk_cache is None:
+        _disk_cache = shelve.open(_DISK_CACHE_PATH)
+    return _disk_cache
+
+
+def _score_one(summary: str, expected_pages: List[int]) -> tuple:
+    """Score a single summary; module-level so process pools can pickle it"""
+    prep = _prepare(summary)
+    return (
+        _citation_metrics(summary, tuple(expected_pages or ()), prep=prep),
+        _quality_metrics(summary, prep=prep)
+    )
+
+
+def _cache_key(summary: str, expected_pages: tuple, reference_summary: str) -> str:
+    """Stable fingerprint of a test case's inputs (blake2b is the fastest
+    keyed hash in hashlib and plenty for cache addressing)"""
+    raw = f"{summary}|{expected_pages}|{reference_summary or ''}"
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
 
 class Evaluator:
     def __init__(self):
         self.results = []
+        # Per-instance memo keyed by input fingerprint; consulted before
+        # the on-disk cache so repeat scores within a run never touch disk
+        self._memo = {}
     
-    def evaluate_citations(self, summary: str, expected_pages: List[int]) -> Dict:
+    def evaluate_citations(self, summary: str, expected_pages: List[int],
+                           prep: Dict = None) -> Dict:
         """
         Evaluate if citations are present and accurate
-        
+
         Metrics:
         - Citation presence rate
         - Citation accuracy (if ground truth available)
         - Average citations per claim
+
+        Pass a precomputed `prep` dict from _prepare to avoid re-walking
+        the summary when several evaluators run on the same string.
         """
-        # Extract citations from summary
-        citations = re.findall(r'\[Page (\d+)\]', summary)
-        cited_pages = [int(p) for p in citations]
-        
-        # Calculate metrics
-        has_citations = len(cited_pages) > 0
-        unique_citations = len(set(cited_pages))
-        
-        # If expected pages provided, check accuracy
-        accuracy = 0
-        if expected_pages:
-            correct = sum(1 for page in cited_pages if page in expected_pages)
-            accuracy = correct / len(cited_pages) if cited_pages else 0
-        
-        # Count sentences/claims
-        sentences = len([s for s in summary.split('.') if s.strip()])
-        citation_density = len(cited_pages) / sentences if sentences > 0 else 0
-        
-        return {
-            'has_citations': has_citations,
-            'total_citations': len(cited_pages),
-            'unique_citations': unique_citations,
-            'citation_accuracy': accuracy,
-            'citation_density': citation_density,
-            'cited_pages': sorted(set(cited_pages))
-        }
-    
-    def evaluate_summary_quality(self, summary: str, reference: str = None) -> Dict:
+        return _citation_metrics(summary, expected_pages, prep=prep)
+
+    def evaluate_summary_quality(self, summary: str, reference: str = None,
+                                 prep: Dict = None) -> Dict:
         """
         Evaluate summary quality using simple metrics
-        
+
         Metrics:
         - Length appropriateness
         - Sentence structure
         - Coverage of key terms (if reference provided)
+
+        Pass a precomputed `prep` dict from _prepare to avoid re-walking
+        the summary when several evaluators run on the same string.
         """
-        # Basic metrics
-        word_count = len(summary.split())
-        sentence_count = len([s for s in summary.split('.') if s.strip()])
-        avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
-        
-        # Check for structure keywords
-        structure_keywords = ['objective', 'method', 'result', 'conclusion', 
-                             'finding', 'approach', 'study', 'research']
-        has_structure = any(kw in summary.lower() for kw in structure_keywords)
-        
-        result = {
-            'word_count': word_count,
-            'sentence_count': sentence_count,
-            'avg_sentence_length': avg_sentence_length,
-            'has_structure': has_structure
-        }
-        
-        # If reference summary provided, calculate overlap
-        if reference:
-            summary_words = set(summary.lower().split())
-            reference_words = set(reference.lower().split())
-            
-            overlap = len(summary_words & reference_words)
-            coverage = overlap / len(reference_words) if reference_words else 0
-            
-            result['word_overlap'] = overlap
-            result['coverage_score'] = coverage
-        
-        return result
+        return _quality_metrics(summary, reference, prep=prep)
     
     def evaluate_retrieval(self, query: str, retrieved_chunks: List[Dict], 
                           relevant_pages: List[int] = None) -> Dict:
@@ -99,7 +234,8 @@ class Evaluator:
         - Relevance (if ground truth provided)
         """
         retrieved_pages = [chunk['page'] for chunk in retrieved_chunks]
-        unique_pages = len(set(retrieved_pages))
+        retrieved_set = set(retrieved_pages)
+        unique_pages = len(retrieved_set)
         
         result = {
             'chunks_retrieved': len(retrieved_chunks),
@@ -109,7 +245,7 @@ class Evaluator:
         
         # If relevant pages provided, calculate precision
         if relevant_pages:
-            relevant_retrieved = sum(1 for page in retrieved_pages if page in relevant_pages)
+            relevant_retrieved = len(retrieved_set & _to_frozenset(tuple(relevant_pages)))
             precision = relevant_retrieved / len(retrieved_pages) if retrieved_pages else 0
             recall = relevant_retrieved / len(relevant_pages) if relevant_pages else 0
             
@@ -119,13 +255,79 @@ class Evaluator:
         
         return result
     
-    def run_test_case(self, test_name: str, summary: str, 
+    def evaluate_batch(self, summaries: List[str],
+                       expected_pages_list: List[List[int]]) -> Dict:
+        """
+        Score many (summary, expected_pages) pairs at once
+
+        The per-record arithmetic (counts, densities, accuracies) runs as
+        vectorized NumPy ops instead of one Python-level run_test_case call
+        per summary. Returns a dict of parallel arrays, one entry per input:
+        total_citations, sentence_count, word_count, citation_density,
+        citation_accuracy, has_citations.
+        """
+        import numpy as np  # deferred so the single-case path stays stdlib-only
+
+        n = len(summaries)
+        cited_lists = [[int(p) for p in _CITATION_RE.findall(s)] for s in summaries]
+
+        totals = np.fromiter((len(c) for c in cited_lists), dtype=np.int32, count=n)
+        sentence_counts = np.fromiter((s.count('.') for s in summaries),
+                                      dtype=np.int32, count=n)
+        word_counts = np.fromiter((len(s.split()) for s in summaries),
+                                  dtype=np.int32, count=n)
+
+        citation_density = totals / np.maximum(sentence_counts, 1)
+        accuracy = np.fromiter(
+            (len(set(c) & frozenset(e)) / len(c) if (c and e) else 0.0
+             for c, e in zip(cited_lists, expected_pages_list)),
+            dtype=np.float64, count=n
+        )
+
+        return {
+            'total_citations': totals,
+            'sentence_count': sentence_counts,
+            'word_count': word_counts,
+            'citation_density': citation_density,
+            'citation_accuracy': accuracy,
+            'has_citations': totals > 0,
+        }
+
+    def evaluate_batch_parallel(self, summaries: List[str],
+                                expected_pages_list: List[List[int]],
+                                max_workers: int = None) -> List[tuple]:
+        """
+        Score summaries across worker processes
+
+        Per-summary scoring is independent and CPU-bound on regex/string
+        work, so large eval sets scale close to linearly with core count.
+        Returns a list of (citation_metrics, quality_metrics) tuples in
+        input order.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(_score_one, summaries,
+                                     expected_pages_list, chunksize=64))
+
+    def run_test_case(self, test_name: str, summary: str,
                       expected_pages: List[int] = None,
                       reference_summary: str = None) -> Dict:
         """Run a complete test case"""
         
-        citation_metrics = self.evaluate_citations(summary, expected_pages or [])
-        quality_metrics = self.evaluate_summary_quality(summary, reference_summary)
+        expected = tuple(expected_pages or ())
+        key = _cache_key(summary, expected, reference_summary)
+
+        metrics = self._memo.get(key)
+        if metrics is None:
+            cache = _get_disk_cache()
+            if key in cache:
+                metrics = cache[key]
+            else:
+                metrics = _compute_metrics(summary, expected, reference_summary)
+                cache[key] = metrics
+            self._memo[key] = metrics
+        citation_metrics, quality_metrics = metrics
         
         test_result = {
             'test_name': test_name,
@@ -141,42 +343,39 @@ class Evaluator:
         """Generate evaluation report"""
         if not self.results:
             return "No test results available"
-        
-        report = "=" * 60 + "\n"
-        report += "EVALUATION REPORT\n"
-        report += "=" * 60 + "\n\n"
-        
+
+        # Accumulate fragments and join once - string += copies the whole
+        # accumulator on every concatenation, which is O(N^2) for big runs
+        parts = [
+            "=" * 60 + "\n",
+            "EVALUATION REPORT\n",
+            "=" * 60 + "\n\n",
+        ]
+
         passed = sum(1 for r in self.results if r['passed'])
         total = len(self.results)
-        
-        report += f"Tests Passed: {passed}/{total} ({passed/total*100:.1f}%)\n\n"
-        
+
+        parts.append(f"Tests Passed: {passed}/{total} ({passed/total*100:.1f}%)\n\n")
+
         for result in self.results:
-            report += f"\nTest: {result['test_name']}\n"
-            report += f"Status: {'✓ PASSED' if result['passed'] else '✗ FAILED'}\n"
-            
-            report += "\nCitation Metrics:\n"
-            cm = result['citation_metrics']
-            report += f"  - Total Citations: {cm['total_citations']}\n"
-            report += f"  - Unique Pages: {cm['unique_citations']}\n"
-            report += f"  - Citation Density: {cm['citation_density']:.2f}\n"
-            report += f"  - Cited Pages: {cm['cited_pages']}\n"
-            
-            report += "\nQuality Metrics:\n"
-            qm = result['quality_metrics']
-            report += f"  - Word Count: {qm['word_count']}\n"
-            report += f"  - Sentences: {qm['sentence_count']}\n"
-            report += f"  - Avg Sentence Length: {qm['avg_sentence_length']:.1f}\n"
-            report += f"  - Has Structure: {qm['has_structure']}\n"
-            
-            report += "\n" + "-" * 60 + "\n"
-        
-        return report
+            flat = {
+                'test_name': result['test_name'],
+                'status': '✓ PASSED' if result['passed'] else '✗ FAILED',
+                **result['citation_metrics'],
+                **result['quality_metrics'],
+            }
+            parts.append(_REPORT_TMPL.format_map(flat))
+
+        return ''.join(parts)
     
     def export_json(self, filename: str = "evaluation_results.json"):
         """Export results to JSON"""
+        # iterencode streams fragments straight to the file, so peak memory
+        # stays O(chunk) instead of holding the whole serialized document
+        encoder = json.JSONEncoder(indent=2)
         with open(filename, 'w') as f:
-            json.dump(self.results, f, indent=2)
+            for chunk in encoder.iterencode(self.results):
+                f.write(chunk)
         print(f"Results exported to {filename}")
 
 
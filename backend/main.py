@@ -1,11 +1,18 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 import fitz  # PyMuPDF
+import hashlib
+import json
+import numpy as np
 import chromadb
 from chromadb.utils import embedding_functions
 import ollama
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import asyncio
+import sqlite3
 import uuid
 import os
 import re
@@ -18,6 +25,14 @@ from pydantic import BaseModel
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hot-path regexes, compiled once at import. smart_chunk_text runs the
+# first two on every page of every upload; the citation pattern runs on
+# every LLM response.
+_WS_RE = re.compile(r'\s+')
+_SENT_RE = re.compile(r'(?<=[.!?])\s+')
+_CITE_RE = re.compile(r'\[Page (\d+)\]')
+_SCORE_RE = re.compile(r'(Methodology Rigor|Data Quality|Citation Quality|Clarity):\s*(\d+)')
+
 app = FastAPI(
     title="AI Research Paper Assistant",
     description="Multi-paper comparison and analysis system",
@@ -42,34 +57,301 @@ app.add_middleware(
 # Configuration
 CHROMA_PATH = "./chroma_db"
 UPLOAD_DIR = "./uploads"
+MODELS_DIR = "./models"
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 MAX_CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
 DEFAULT_MODEL = "llama3.2"
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
 MAX_PAPERS_COMPARE = 5
 
 # Create directories
 Path(CHROMA_PATH).mkdir(exist_ok=True)
 Path(UPLOAD_DIR).mkdir(exist_ok=True)
+Path(MODELS_DIR).mkdir(exist_ok=True)
 
-# Initialize ChromaDB
-try:
-    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    sentence_transformer_ef = embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="all-MiniLM-L6-v2"
+
+def _build_embedding_function():
+    """
+    Build the embedding function for ChromaDB.
+
+    Prefers an INT8 dynamic-quantized ONNX export of the embedding model:
+    the Linear/MatMul ops then run as int8 dot products (VNNI on recent
+    CPUs), which is ~2-4x faster than FP32 with negligible recall loss.
+    The export is built once under MODELS_DIR and reused on later startups.
+    Falls back to the stock FP32 SentenceTransformer path when the ONNX
+    stack is not installed.
+    """
+    try:
+        import onnxruntime as ort
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+    except ImportError:
+        logger.info("ONNX stack not installed - using FP32 sentence-transformers embeddings")
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBEDDING_MODEL
+        )
+
+    quant_dir = Path(MODELS_DIR) / f"{EMBEDDING_MODEL}-qint8"
+
+    if not quant_dir.exists():
+        logger.info(f"Exporting INT8 quantized embedding model to {quant_dir}...")
+        model = ORTModelForFeatureExtraction.from_pretrained(
+            f"sentence-transformers/{EMBEDDING_MODEL}", export=True
+        )
+        quantizer = ORTQuantizer.from_pretrained(model)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        quantizer.quantize(save_dir=str(quant_dir), quantization_config=qconfig)
+
+    # Pin one parallel, fully optimized session for the process so every
+    # embedding call reuses the same compiled kernels
+    session_options = ort.SessionOptions()
+    session_options.intra_op_num_threads = os.cpu_count()
+    session_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    tokenizer = AutoTokenizer.from_pretrained(str(quant_dir))
+    ort_model = ORTModelForFeatureExtraction.from_pretrained(
+        str(quant_dir), session_options=session_options
     )
+
+    class ONNXEmbeddingFunction:
+        """Mean-pooled, L2-normalized embeddings matching the
+        sentence-transformers output for the same model"""
+
+        def __call__(self, input):
+            encoded = tokenizer(
+                list(input), padding=True, truncation=True,
+                max_length=256, return_tensors="pt"
+            )
+            hidden = ort_model(**encoded).last_hidden_state.detach().numpy()
+            mask = encoded["attention_mask"].numpy()[..., None].astype(hidden.dtype)
+            embeddings = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            return embeddings.tolist()
+
+    logger.info("✓ INT8 ONNX embedding backend ready")
+    return ONNXEmbeddingFunction()
+
+
+# Initialize ChromaDB. With CHROMA_HOST set, talk to a separate chroma
+# server (start one with `chroma run --path ./chroma_db --port 8001`) so
+# HNSW builds and SQLite writes live outside the API process and uploads
+# don't compete with query handling for this worker's memory. Without it,
+# fall back to the embedded client for single-process dev.
+CHROMA_HOST = os.getenv("CHROMA_HOST")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8001"))
+
+try:
+    if CHROMA_HOST:
+        chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT)
+        logger.info(f"✓ Connected to Chroma server at {CHROMA_HOST}:{CHROMA_PORT}")
+    else:
+        chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    sentence_transformer_ef = _build_embedding_function()
     logger.info("✓ ChromaDB initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize ChromaDB: {e}")
     raise
 
-# Store for active collections
-active_collections = {}
+# Async Ollama client so LLM calls don't block the event loop
+ollama_client = ollama.AsyncClient()
+
+# Query cache: an exact-match dict in front of a semantic Chroma collection
+# mapping previously embedded questions to their generated answers. A repeat
+# or near-duplicate question skips retrieval and the LLM entirely.
+SEMANTIC_CACHE_MAX_DISTANCE = 0.05  # cosine distance ~= similarity > 0.95
+query_cache_collection = chroma_client.get_or_create_collection(
+    "query_cache", embedding_function=sentence_transformer_ef
+)
+# {collection_id: {question_digest: result}} so a deleted paper's entries
+# can be invalidated in one pop
+_exact_query_cache = {}
+
+
+def _query_cache_key(collection_id: str, question: str) -> str:
+    normalized = ' '.join(question.lower().split())
+    return hashlib.blake2b(
+        f"{collection_id}|{normalized}".encode('utf-8'), digest_size=16
+    ).hexdigest()
+
+
+def _semantic_cache_lookup(collection_id: str, question: str):
+    """Return a cached answer for a semantically near-identical question, or None"""
+    try:
+        hits = query_cache_collection.query(
+            query_texts=[question],
+            n_results=1,
+            where={"collection_id": collection_id}
+        )
+        if hits['ids'][0] and hits['distances'][0][0] < SEMANTIC_CACHE_MAX_DISTANCE:
+            return json.loads(hits['metadatas'][0][0]['result'])
+    except Exception as e:
+        logger.warning(f"Semantic cache lookup failed: {e}")
+    return None
+
+
+def _cache_query_result(key: str, collection_id: str, question: str, result: Dict):
+    _exact_query_cache.setdefault(collection_id, {})[key] = result
+    try:
+        query_cache_collection.add(
+            documents=[question],
+            metadatas=[{'collection_id': collection_id, 'result': json.dumps(result)}],
+            ids=[key]
+        )
+    except Exception as e:
+        logger.warning(f"Semantic cache store failed: {e}")
+
+
+# Paper metadata lives in SQLite rather than a process dict, so uploads
+# survive restarts and memory stays flat regardless of upload count.
+# Collection handles are fetched lazily from Chroma per request.
+APP_META_DB = str(Path(CHROMA_PATH) / "app_meta.db")
+
+with sqlite3.connect(APP_META_DB) as _conn:
+    _conn.execute("""
+        CREATE TABLE IF NOT EXISTS papers (
+            collection_id TEXT PRIMARY KEY,
+            filename TEXT,
+            upload_time TEXT,
+            metadata_json TEXT,
+            quality_json TEXT,
+            file_path TEXT,
+            total_chunks INTEGER,
+            centroid_json TEXT
+        )
+    """)
+    # Databases created before the centroid column need the extra field
+    _cols = [row[1] for row in _conn.execute("PRAGMA table_info(papers)")]
+    if 'centroid_json' not in _cols:
+        _conn.execute("ALTER TABLE papers ADD COLUMN centroid_json TEXT")
+
+
+def _save_paper(collection_id: str, filename: str, upload_time: str,
+                metadata: Dict, quality: Dict, file_path: str, total_chunks: int,
+                centroid: Optional[List[float]] = None):
+    with sqlite3.connect(APP_META_DB) as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO papers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (collection_id, filename, upload_time, json.dumps(metadata),
+             json.dumps(quality), file_path, total_chunks,
+             json.dumps(centroid) if centroid is not None else None)
+        )
+
+
+def _row_to_paper(row) -> Dict:
+    return {
+        'filename': row[0],
+        'upload_time': row[1],
+        'metadata': json.loads(row[2]),
+        'quality_score': json.loads(row[3]),
+        'file_path': row[4],
+        'total_chunks': row[5],
+    }
+
+
+def _get_paper(collection_id: str) -> Optional[Dict]:
+    with sqlite3.connect(APP_META_DB) as conn:
+        row = conn.execute(
+            "SELECT filename, upload_time, metadata_json, quality_json, "
+            "file_path, total_chunks FROM papers WHERE collection_id = ?",
+            (collection_id,)
+        ).fetchone()
+    return _row_to_paper(row) if row else None
+
+
+def _list_papers() -> List[Dict]:
+    with sqlite3.connect(APP_META_DB) as conn:
+        rows = conn.execute(
+            "SELECT collection_id, filename, upload_time, metadata_json, "
+            "quality_json, file_path, total_chunks FROM papers"
+        ).fetchall()
+    papers = []
+    for row in rows:
+        paper = _row_to_paper(row[1:])
+        paper['id'] = row[0]
+        papers.append(paper)
+    return papers
+
+
+def _delete_paper(collection_id: str):
+    with sqlite3.connect(APP_META_DB) as conn:
+        conn.execute("DELETE FROM papers WHERE collection_id = ?", (collection_id,))
+
+
+def _get_centroid(collection_id: str) -> Optional[List[float]]:
+    """Fetch a paper's centroid embedding saved at ingestion.
+
+    Falls back to averaging the collection's stored embeddings for papers
+    ingested before centroids were recorded, and backfills the row so the
+    O(N) fetch happens at most once per legacy paper.
+    """
+    with sqlite3.connect(APP_META_DB) as conn:
+        row = conn.execute(
+            "SELECT centroid_json FROM papers WHERE collection_id = ?",
+            (collection_id,)
+        ).fetchone()
+    if row and row[0]:
+        return json.loads(row[0])
+
+    collection = _get_collection(collection_id)
+    embeddings = collection.get(include=["embeddings"])['embeddings']
+    if not embeddings:
+        return None
+    centroid = np.asarray(embeddings, dtype=np.float32).mean(axis=0).tolist()
+    with sqlite3.connect(APP_META_DB) as conn:
+        conn.execute(
+            "UPDATE papers SET centroid_json = ? WHERE collection_id = ?",
+            (json.dumps(centroid), collection_id)
+        )
+    return centroid
+
+
+def _count_papers() -> int:
+    with sqlite3.connect(APP_META_DB) as conn:
+        return conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+
+
+def _get_collection(collection_id: str):
+    return chroma_client.get_collection(
+        collection_id, embedding_function=sentence_transformer_ef
+    )
+
+
+def _sample_chunks(collection, sample_size: int) -> List[Dict]:
+    """
+    Fetch up to sample_size chunks spread evenly across a collection.
+
+    Uses count() plus one limit/offset get per sampled index, so only the
+    sampled documents are deserialized - the old approach pulled every
+    document and embedding in the collection just to pick 8-10 of them.
+    """
+    total = collection.count()
+    if total == 0:
+        return []
+
+    sample_size = min(sample_size, total)
+    step = max(1, total // sample_size)
+    indices = sorted({min(i * step, total - 1) for i in range(sample_size)})
+
+    samples = []
+    for idx in indices:
+        got = collection.get(limit=1, offset=idx, include=["documents", "metadatas"])
+        if got['documents']:
+            samples.append({
+                'text': got['documents'][0],
+                'page': got['metadatas'][0]['page']
+            })
+    return samples
 
 # Pydantic models
 class QueryRequest(BaseModel):
     question: str
 
+class BatchQueryRequest(BaseModel):
+    questions: List[str]
+
 class CompareRequest(BaseModel):
     collection_ids: List[str]
     comparison_type: Optional[str] = "comprehensive"  # comprehensive, methodology, findings
@@ -98,44 +380,64 @@ async def startup_event():
     except Exception as e:
         logger.error(f"❌ Ollama check failed: {e}")
 
+    # Force the embedding model to materialize now; otherwise the first
+    # /upload pays the multi-second model-load penalty on top of embedding
+    try:
+        await asyncio.to_thread(sentence_transformer_ef, ["warmup"])
+        logger.info("✓ Embedding model warmed up")
+    except Exception as e:
+        logger.error(f"❌ Embedding model warmup failed: {e}")
+
+
+def _chunk_id(chunk_text: str) -> str:
+    """Content-addressed chunk ID: identical text always hashes to the
+    same ID, so duplicate chunks (re-uploads, shared boilerplate) can be
+    detected and skipped instead of re-embedded."""
+    return hashlib.blake2b(chunk_text.encode('utf-8'), digest_size=16).hexdigest()
+
 
 def smart_chunk_text(text: str, page_num: int) -> List[Dict]:
     """Enhanced text chunking with sentence boundaries"""
     if not text or len(text.strip()) < 50:
         return []
     
-    text = re.sub(r'\s+', ' ', text).strip()
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    text = _WS_RE.sub(' ', text).strip()
+    sentences = _SENT_RE.split(text)
     
     chunks = []
     current_chunk = []
+    current_lens = []  # word count per sentence, kept in lockstep
     current_length = 0
-    
+
     for sentence in sentences:
         sentence = sentence.strip()
         if not sentence:
             continue
-            
-        words = sentence.split()
-        sentence_length = len(words)
-        
+
+        # The text was whitespace-normalized above, so counting spaces is
+        # an exact word count without allocating a split list
+        sentence_length = sentence.count(' ') + 1
+
         if current_length + sentence_length > MAX_CHUNK_SIZE and current_chunk:
             chunk_text = ' '.join(current_chunk)
             chunks.append({
                 'text': chunk_text,
                 'page': page_num,
-                'id': str(uuid.uuid4())
+                'id': _chunk_id(chunk_text)
             })
-            
+
+            # Keep the last two sentences as overlap; their lengths are
+            # already known, so no re-splitting of the carried sentences
             if len(current_chunk) >= 3:
-                overlap_sentences = current_chunk[-2:]
-            else:
-                overlap_sentences = current_chunk
-            
-            current_chunk = overlap_sentences + [sentence]
-            current_length = sum(len(s.split()) for s in current_chunk)
+                current_chunk = current_chunk[-2:]
+                current_lens = current_lens[-2:]
+
+            current_chunk.append(sentence)
+            current_lens.append(sentence_length)
+            current_length = sum(current_lens)
         else:
             current_chunk.append(sentence)
+            current_lens.append(sentence_length)
             current_length += sentence_length
     
     if current_chunk:
@@ -144,9 +446,9 @@ def smart_chunk_text(text: str, page_num: int) -> List[Dict]:
             chunks.append({
                 'text': chunk_text,
                 'page': page_num,
-                'id': str(uuid.uuid4())
+                'id': _chunk_id(chunk_text)
             })
-    
+
     return chunks
 
 
@@ -162,14 +464,24 @@ def extract_text_from_pdf(pdf_path: str) -> Dict:
             'author': doc.metadata.get('author', 'Unknown'),
         }
         
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            text = page.get_text()
-            
-            if text.strip():
-                page_chunks = smart_chunk_text(text, page_num + 1)
+        # Pages are independent and get_text releases the GIL inside MuPDF,
+        # so extraction scales with cores; chunking each page is pure-Python
+        # regex work and overlaps the same pool. map preserves page order.
+        # "blocks" skips MuPDF's full text reflow and pre-segments the page
+        # into paragraphs; block type 0 is text (1 is image).
+        total_pages = len(doc)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            page_texts = list(executor.map(
+                lambda i: "\n".join(
+                    b[4] for b in doc[i].get_text("blocks") if b[6] == 0
+                ),
+                range(total_pages)
+            ))
+            for page_chunks in executor.map(
+                smart_chunk_text, page_texts, range(1, total_pages + 1)
+            ):
                 chunks.extend(page_chunks)
-        
+
         doc.close()
         
         if not chunks:
@@ -192,61 +504,127 @@ def create_vector_db(chunks: List[Dict], collection_name: str):
         except:
             pass
         
+        # Chroma's HNSW defaults (M=16, construction_ef=100, search_ef=10)
+        # under-search the graph for larger papers. A denser graph and
+        # deeper construction for big collections, plus a search_ef well
+        # above the usual n_results, buys noticeably better recall for a
+        # small query-latency cost.
+        # Chunk IDs are content hashes, so identical text maps to the
+        # same ID; drop repeats up front rather than tripping Chroma's
+        # duplicate-id handling and embedding the same text twice.
+        unique_chunks = {chunk['id']: chunk for chunk in chunks}
+        if len(unique_chunks) < len(chunks):
+            logger.info(
+                f"Skipping {len(chunks) - len(unique_chunks)} duplicate chunks"
+            )
+        chunks = list(unique_chunks.values())
+
+        n = len(chunks)
         collection = chroma_client.create_collection(
             name=collection_name,
             embedding_function=sentence_transformer_ef,
-            metadata={"hnsw:space": "cosine"}
+            metadata={
+                "hnsw:space": "cosine",
+                "hnsw:M": 16 if n < 1000 else 24,
+                "hnsw:construction_ef": 100 if n < 1000 else 200,
+                "hnsw:search_ef": 64,
+            }
         )
-        
-        batch_size = 100
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
+
+        # Smart batching: embed in length-sorted order so each batch holds
+        # similar-length texts and the tokenizer wastes little work on
+        # padding, then pass the embeddings explicitly so Chroma skips its
+        # internal per-add embedding path. Insertion order doesn't matter
+        # to the index; ids/metadatas stay aligned with their chunks.
+        order = sorted(range(len(chunks)), key=lambda i: len(chunks[i]['text']))
+        batch_size = 250
+        embedding_sum = None
+        for start in range(0, len(order), batch_size):
+            batch = [chunks[i] for i in order[start:start + batch_size]]
+            texts = [chunk['text'] for chunk in batch]
+            embeddings = sentence_transformer_ef(texts)
             collection.add(
-                documents=[chunk['text'] for chunk in batch],
+                documents=texts,
+                embeddings=embeddings,
                 metadatas=[{'page': chunk['page']} for chunk in batch],
                 ids=[chunk['id'] for chunk in batch]
             )
-        
+            # Accumulate the centroid while the embeddings are in hand;
+            # /compare then never has to pull them back out of Chroma
+            batch_sum = np.asarray(embeddings, dtype=np.float32).sum(axis=0)
+            embedding_sum = batch_sum if embedding_sum is None else embedding_sum + batch_sum
+
+        centroid = (embedding_sum / len(chunks)).tolist()
+
         logger.info(f"✓ Vector DB created with {len(chunks)} chunks")
-        return collection
+        return collection, centroid
     except Exception as e:
         logger.error(f"Vector DB creation failed: {e}")
         raise
 
 
+@lru_cache(maxsize=1024)
+def _embed_query(query: str) -> tuple:
+    """Embed a query string, memoized across collections.
+
+    Repeat questions skip the transformer forward pass entirely.
+    lru_cache's own lock makes this safe to call from to_thread workers;
+    the tuple return keeps the cached value hashable and immutable.
+    """
+    return tuple(sentence_transformer_ef([query])[0])
+
+
 def retrieve_relevant_chunks(collection, query: str, n_results: int = 8):
-    """Retrieve most relevant chunks for query"""
+    """
+    Retrieve most relevant chunks for query.
+
+    Over-fetches 4x candidates from the approximate HNSW search and
+    re-ranks them with exact cosine similarity against the query
+    embedding, so the final top-n isn't at the mercy of ANN recall.
+    relevance_score is the actual cosine similarity rather than the old
+    rank-based placeholder.
+    """
     try:
+        query_embedding = list(_embed_query(query))
+
         results = collection.query(
-            query_texts=[query],
-            n_results=n_results
+            query_embeddings=[query_embedding],
+            n_results=n_results * 4,
+            include=["documents", "metadatas", "embeddings"]
         )
-        
+
+        docs = results['documents'][0]
+        metas = results['metadatas'][0]
+        embeddings = np.asarray(results['embeddings'][0], dtype=np.float32)
+        q = np.asarray(query_embedding, dtype=np.float32)
+
+        scores = embeddings @ q / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(q) + 1e-12
+        )
+
         retrieved = []
-        for i, doc in enumerate(results['documents'][0]):
-            page = results['metadatas'][0][i]['page']
+        for i in np.argsort(-scores)[:n_results]:
             retrieved.append({
-                'text': doc,
-                'page': page,
-                'relevance_score': 1.0 - (i * 0.08)
+                'text': docs[i],
+                'page': metas[i]['page'],
+                'relevance_score': round(float(scores[i]), 4)
             })
-        
+
         return retrieved
     except Exception as e:
         logger.error(f"Retrieval failed: {e}")
         raise
 
 
-def generate_summary_with_citations(chunks: List[Dict], query: str = None) -> Dict:
-    """Generate summary or answer with citations"""
-    try:
-        context = "\n\n".join([
-            f"[Page {chunk['page']}]: {chunk['text']}" 
-            for chunk in chunks
-        ])
-        
-        if query:
-            prompt = f"""You are a research assistant. Answer the question based on the provided excerpts.
+def _build_summary_prompt(chunks: List[Dict], query: str = None) -> str:
+    """Build the summary/answer prompt from retrieved chunks"""
+    context = "\n\n".join([
+        f"[Page {chunk['page']}]: {chunk['text']}"
+        for chunk in chunks
+    ])
+
+    if query:
+        return f"""You are a research assistant. Answer the question based on the provided excerpts.
 
 Question: {query}
 
@@ -260,8 +638,8 @@ Instructions:
 4. If answer not in excerpts, state so clearly
 
 Answer:"""
-        else:
-            prompt = f"""Create a comprehensive summary with these sections:
+
+    return f"""Create a comprehensive summary with these sections:
 
 Excerpts:
 {context}
@@ -281,46 +659,95 @@ Excerpts:
 Important: Cite [Page X] after EACH claim.
 
 Summary:"""
-        
-        response = ollama.chat(
+
+
+def _summary_result(summary: str, chunks: List[Dict]) -> Dict:
+    """Post-process a generated summary: citations and confidence scoring"""
+    citations = _CITE_RE.findall(summary)
+    unique_pages = sorted(list(set([int(p) for p in citations])))
+
+    sentences = [s for s in summary.split('.') if s.strip()]
+    word_count = len(summary.split())
+    citation_density = len(citations) / len(sentences) if sentences else 0
+
+    density_score = min(1.0, citation_density / 0.4)
+    coverage_score = min(1.0, len(unique_pages) / 4)
+    length_score = 1.0 if 80 < word_count < 800 else 0.7
+
+    confidence = (density_score * 0.5 + coverage_score * 0.3 + length_score * 0.2)
+    confidence = max(0.3, min(1.0, confidence))
+
+    return {
+        'summary': summary,
+        'cited_pages': unique_pages,
+        'chunks_used': len(chunks),
+        'confidence_score': round(confidence, 2),
+        'metadata': {
+            'word_count': word_count,
+            'citation_count': len(citations),
+            'unique_citations': len(unique_pages),
+            'citation_density': round(citation_density, 2)
+        }
+    }
+
+
+async def generate_summary_with_citations(chunks: List[Dict], query: str = None) -> Dict:
+    """Generate summary or answer with citations"""
+    try:
+        prompt = _build_summary_prompt(chunks, query)
+
+        response = await ollama_client.chat(
             model=DEFAULT_MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
-            stream=False
+            messages=[{'role': 'user', 'content': prompt}]
         )
-        
-        summary = response['message']['content']
-        citations = re.findall(r'\[Page (\d+)\]', summary)
-        unique_pages = sorted(list(set([int(p) for p in citations])))
-        
-        sentences = [s for s in summary.split('.') if s.strip()]
-        word_count = len(summary.split())
-        citation_density = len(citations) / len(sentences) if sentences else 0
-        
-        density_score = min(1.0, citation_density / 0.4)
-        coverage_score = min(1.0, len(unique_pages) / 4)
-        length_score = 1.0 if 80 < word_count < 800 else 0.7
-        
-        confidence = (density_score * 0.5 + coverage_score * 0.3 + length_score * 0.2)
-        confidence = max(0.3, min(1.0, confidence))
-        
-        return {
-            'summary': summary,
-            'cited_pages': unique_pages,
-            'chunks_used': len(chunks),
-            'confidence_score': round(confidence, 2),
-            'metadata': {
-                'word_count': word_count,
-                'citation_count': len(citations),
-                'unique_citations': len(unique_pages),
-                'citation_density': round(citation_density, 2)
-            }
-        }
+
+        return _summary_result(response['message']['content'], chunks)
     except Exception as e:
         logger.error(f"Summary generation failed: {e}")
         raise HTTPException(status_code=500, detail=f"LLM error: {str(e)}")
 
 
-def analyze_paper_quality(chunks: List[Dict], metadata: Dict) -> Dict:
+async def stream_summary_with_citations(chunks: List[Dict], query: str = None,
+                                        on_complete=None):
+    """
+    SSE generator variant of generate_summary_with_citations.
+
+    Yields `data:` frames with content deltas as Ollama produces them, then
+    a final `event: metadata` frame carrying the citations and confidence
+    scores once the stream finishes. Time-to-first-token drops to however
+    fast the model starts, instead of waiting out the whole completion.
+    """
+    try:
+        prompt = _build_summary_prompt(chunks, query)
+        parts = []
+
+        stream = await ollama_client.chat(
+            model=DEFAULT_MODEL,
+            messages=[{'role': 'user', 'content': prompt}],
+            stream=True
+        )
+        async for chunk in stream:
+            delta = chunk['message']['content']
+            if delta:
+                parts.append(delta)
+                yield f"data: {json.dumps({'content': delta})}\n\n"
+
+        result = _summary_result(''.join(parts), chunks)
+        if on_complete is not None:
+            on_complete(result)
+        yield f"event: metadata\ndata: {json.dumps(result)}\n\n"
+    except Exception as e:
+        logger.error(f"Streaming generation failed: {e}")
+        yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+
+async def _sse_replay(result: Dict):
+    """Serve an already-complete result over the SSE framing"""
+    yield f"data: {json.dumps({'content': result['summary']})}\n\n"
+    yield f"event: metadata\ndata: {json.dumps(result)}\n\n"
+
+
+async def analyze_paper_quality(chunks: List[Dict], metadata: Dict) -> Dict:
     """Analyze paper quality and generate score"""
     try:
         # Sample chunks for analysis
@@ -349,24 +776,20 @@ Overall Assessment: [2-3 sentences]
 
 Be strict but fair in scoring."""
         
-        response = ollama.chat(
+        response = await ollama_client.chat(
             model=DEFAULT_MODEL,
-            messages=[{'role': 'user', 'content': prompt}],
-            stream=False
+            messages=[{'role': 'user', 'content': prompt}]
         )
-        
+
         analysis = response['message']['content']
         
-        # Extract scores
-        methodology_match = re.search(r'Methodology Rigor:\s*(\d+)', analysis)
-        data_match = re.search(r'Data Quality:\s*(\d+)', analysis)
-        citation_match = re.search(r'Citation Quality:\s*(\d+)', analysis)
-        clarity_match = re.search(r'Clarity:\s*(\d+)', analysis)
-        
-        methodology_score = int(methodology_match.group(1)) if methodology_match else 70
-        data_score = int(data_match.group(1)) if data_match else 70
-        citation_score = int(citation_match.group(1)) if citation_match else 70
-        clarity_score = int(clarity_match.group(1)) if clarity_match else 70
+        # Extract all four scores in one pass over the analysis
+        scores = {m.group(1): int(m.group(2)) for m in _SCORE_RE.finditer(analysis)}
+
+        methodology_score = scores.get('Methodology Rigor', 70)
+        data_score = scores.get('Data Quality', 70)
+        citation_score = scores.get('Citation Quality', 70)
+        clarity_score = scores.get('Clarity', 70)
         
         overall_score = (methodology_score + data_score + citation_score + clarity_score) / 4
         
@@ -404,55 +827,62 @@ async def upload_pdf(file: UploadFile = File(...)):
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files allowed")
     
-    content = await file.read()
-    file_size = len(content)
-    
-    if file_size > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail=f"File too large. Max {MAX_FILE_SIZE // (1024*1024)}MB")
-    
-    if file_size < 1000:
-        raise HTTPException(status_code=400, detail="File too small or empty")
-    
     file_id = uuid.uuid4().hex[:12]
     file_path = Path(UPLOAD_DIR) / f"{file_id}_{file.filename}"
-    
+
     try:
+        # Stream the upload to disk in 1MB pieces instead of buffering the
+        # whole PDF in memory; oversize files are rejected as soon as the
+        # running total crosses the cap, not after a full read
+        file_size = 0
         with open(file_path, "wb") as f:
-            f.write(content)
-        
+            while chunk := await file.read(1 << 20):
+                file_size += len(chunk)
+                if file_size > MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"File too large. Max {MAX_FILE_SIZE // (1024*1024)}MB"
+                    )
+                f.write(chunk)
+
+        if file_size < 1000:
+            raise HTTPException(status_code=400, detail="File too small or empty")
+
         logger.info(f"Processing PDF: {file.filename}")
-        extraction_result = extract_text_from_pdf(str(file_path))
+        # Extraction and embedding are CPU-bound; run them off the event
+        # loop so concurrent requests aren't serialized behind an upload
+        extraction_result = await asyncio.to_thread(extract_text_from_pdf, str(file_path))
         chunks = extraction_result['chunks']
         metadata = extraction_result['metadata']
-        
+
         logger.info(f"Extracted {len(chunks)} chunks from {metadata['total_pages']} pages")
-        
+
         collection_name = f"doc_{file_id}"
-        collection = create_vector_db(chunks, collection_name)
-        
+        _, centroid = await asyncio.to_thread(create_vector_db, chunks, collection_name)
+
         # Analyze quality
-        quality_analysis = analyze_paper_quality(chunks, metadata)
-        
-        active_collections[collection_name] = {
-            'collection': collection,
-            'filename': file.filename,
-            'upload_time': datetime.now().isoformat(),
-            'metadata': metadata,
-            'total_chunks': len(chunks),
-            'file_path': str(file_path),
-            'quality_score': quality_analysis
-        }
+        quality_analysis = await analyze_paper_quality(chunks, metadata)
         
+        _save_paper(
+            collection_name, file.filename, datetime.now().isoformat(),
+            metadata, quality_analysis, str(file_path), len(chunks),
+            centroid=centroid
+        )
+
         logger.info(f"✓ Collection created: {collection_name}")
-        
-        return JSONResponse(content={
+
+        return {
             'collection_id': collection_name,
             'total_chunks': len(chunks),
             'filename': file.filename,
             'paper_metadata': metadata,
             'quality_score': quality_analysis
-        })
+        }
     
+    except HTTPException:
+        if file_path.exists():
+            file_path.unlink()
+        raise
     except Exception as e:
         if file_path.exists():
             file_path.unlink()
@@ -465,24 +895,30 @@ async def upload_multiple_pdfs(files: List[UploadFile] = File(...)):
     """Upload multiple PDFs for comparison"""
     if len(files) > MAX_PAPERS_COMPARE:
         raise HTTPException(status_code=400, detail=f"Maximum {MAX_PAPERS_COMPARE} papers allowed")
-    
+
+    # Process the PDFs concurrently; wall time is bounded by the slowest
+    # upload rather than the sum of all of them
+    outcomes = await asyncio.gather(
+        *[upload_pdf(file) for file in files],
+        return_exceptions=True
+    )
+
     results = []
     errors = []
-    
-    for file in files:
-        try:
-            result = await upload_pdf(file)
-            results.append(result.body.decode())
-        except Exception as e:
+
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, Exception):
             errors.append({
                 'filename': file.filename,
-                'error': str(e)
+                'error': str(outcome)
             })
-    
+        else:
+            results.append(outcome)
+
     return {
         'uploaded': len(results),
         'failed': len(errors),
-        'results': [eval(r) for r in results],
+        'results': results,
         'errors': errors
     }
 
@@ -499,38 +935,28 @@ async def compare_papers(compare_req: CompareRequest):
         raise HTTPException(status_code=400, detail=f"Maximum {MAX_PAPERS_COMPARE} papers allowed")
     
     # Validate collections
+    papers = {}
     for coll_id in collection_ids:
-        if coll_id not in active_collections:
+        paper = _get_paper(coll_id)
+        if paper is None:
             raise HTTPException(status_code=404, detail=f"Collection {coll_id} not found")
-    
+        papers[coll_id] = paper
+
     try:
         # Gather paper summaries
         paper_summaries = []
-        
+
         for coll_id in collection_ids:
-            collection = active_collections[coll_id]['collection']
-            metadata = active_collections[coll_id]['metadata']
-            filename = active_collections[coll_id]['filename']
-            quality = active_collections[coll_id].get('quality_score', {})
+            collection = _get_collection(coll_id)
+            metadata = papers[coll_id]['metadata']
+            filename = papers[coll_id]['filename']
+            quality = papers[coll_id].get('quality_score', {})
             
             # Get representative chunks
-            all_results = collection.get()
-            total_chunks = len(all_results['ids'])
-            
-            sample_size = min(8, total_chunks)
-            step = max(1, total_chunks // sample_size)
-            indices = [i * step for i in range(sample_size)]
-            
-            sample_chunks = []
-            for idx in indices:
-                if idx < total_chunks:
-                    sample_chunks.append({
-                        'text': all_results['documents'][idx],
-                        'page': all_results['metadatas'][idx]['page']
-                    })
-            
+            sample_chunks = _sample_chunks(collection, 8)
+
             # Generate summary
-            summary_result = generate_summary_with_citations(sample_chunks)
+            summary_result = await generate_summary_with_citations(sample_chunks)
             
             paper_summaries.append({
                 'collection_id': coll_id,
@@ -582,27 +1008,24 @@ Which paper is most valuable for different use cases?
 
 Be thorough, specific, and cite paper numbers [Paper 1], [Paper 2], etc."""
         
-        response = ollama.chat(
+        response = await ollama_client.chat(
             model=DEFAULT_MODEL,
-            messages=[{'role': 'user', 'content': comparison_prompt}],
-            stream=False
+            messages=[{'role': 'user', 'content': comparison_prompt}]
         )
-        
+
         comparison_analysis = response['message']['content']
         
-        # Create comparison matrix
-        matrix = []
-        for i, paper1 in enumerate(paper_summaries):
-            row = []
-            for j, paper2 in enumerate(paper_summaries):
-                if i == j:
-                    similarity = 100
-                else:
-                    # Simple similarity based on quality scores
-                    similarity = 100 - abs(paper1['quality_score'] - paper2['quality_score'])
-                row.append(round(similarity, 1))
-            matrix.append(row)
-        
+        # Similarity matrix from cosine similarity of the papers' centroid
+        # embeddings - one matmul over the k x d centroid stack, rather
+        # than the old quality-score-delta placeholder
+        centroids = np.asarray(
+            [_get_centroid(coll_id) for coll_id in collection_ids],
+            dtype=np.float32
+        )
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        matrix = (centroids @ centroids.T * 100).round(1).tolist()
+
+
         return {
             'papers': paper_summaries,
             'comparison_analysis': comparison_analysis,
@@ -617,39 +1040,31 @@ Be thorough, specific, and cite paper numbers [Paper 1], [Paper 2], etc."""
 
 
 @app.post("/summarize/{collection_id}")
-async def summarize_paper(collection_id: str):
-    """Generate comprehensive paper summary"""
-    if collection_id not in active_collections:
+async def summarize_paper(collection_id: str, stream: bool = False):
+    """Generate comprehensive paper summary
+
+    With ?stream=true the summary is sent as server-sent events while the
+    model generates, followed by a metadata event with citations and
+    confidence; the default response stays a single JSON document.
+    """
+    if _get_paper(collection_id) is None:
         raise HTTPException(status_code=404, detail="Collection not found")
-    
+
     try:
-        collection = active_collections[collection_id]['collection']
-        
-        all_results = collection.get()
-        total_chunks = len(all_results['ids'])
-        
-        if total_chunks == 0:
+        collection = _get_collection(collection_id)
+
+        sample_chunks = _sample_chunks(collection, 10)
+
+        if not sample_chunks:
             raise HTTPException(status_code=500, detail="No content found")
-        
-        sample_size = min(10, total_chunks)
-        indices = []
-        
-        if total_chunks <= 10:
-            indices = list(range(total_chunks))
-        else:
-            step = total_chunks // (sample_size - 1)
-            indices = [i * step for i in range(sample_size - 1)]
-            indices.append(total_chunks - 1)
-        
-        sample_chunks = []
-        for idx in indices:
-            if idx < total_chunks:
-                sample_chunks.append({
-                    'text': all_results['documents'][idx],
-                    'page': all_results['metadatas'][idx]['page']
-                })
-        
-        result = generate_summary_with_citations(sample_chunks)
+
+        if stream:
+            return StreamingResponse(
+                stream_summary_with_citations(sample_chunks),
+                media_type="text/event-stream"
+            )
+
+        result = await generate_summary_with_citations(sample_chunks)
         logger.info(f"✓ Summary generated for {collection_id}")
         
         return result
@@ -662,9 +1077,15 @@ async def summarize_paper(collection_id: str):
 
 
 @app.post("/query/{collection_id}")
-async def query_paper(collection_id: str, query_data: QueryRequest):
-    """Answer specific questions about the paper"""
-    if collection_id not in active_collections:
+async def query_paper(collection_id: str, query_data: QueryRequest,
+                      stream: bool = False):
+    """Answer specific questions about the paper
+
+    With ?stream=true the answer is sent as server-sent events while the
+    model generates; see summarize_paper. Cache hits replay over the same
+    framing so clients can use one code path.
+    """
+    if _get_paper(collection_id) is None:
         raise HTTPException(status_code=404, detail="Collection not found")
     
     question = query_data.question.strip()
@@ -673,10 +1094,43 @@ async def query_paper(collection_id: str, query_data: QueryRequest):
         raise HTTPException(status_code=400, detail="Question too short")
     
     try:
-        collection = active_collections[collection_id]['collection']
-        relevant_chunks = retrieve_relevant_chunks(collection, question, n_results=8)
-        result = generate_summary_with_citations(relevant_chunks, query=question)
-        
+        # Exact-match cache first, then semantically near-identical questions
+        cache_key = _query_cache_key(collection_id, question)
+        cached = _exact_query_cache.get(collection_id, {}).get(cache_key)
+        if cached is None:
+            cached = await asyncio.to_thread(
+                _semantic_cache_lookup, collection_id, question
+            )
+        if cached is not None:
+            logger.info(f"✓ Query cache hit for {collection_id}")
+            if stream:
+                return StreamingResponse(
+                    _sse_replay(cached), media_type="text/event-stream"
+                )
+            return cached
+
+        collection = _get_collection(collection_id)
+        # Retrieval embeds the query - CPU-bound, so off the loop as well
+        relevant_chunks = await asyncio.to_thread(
+            retrieve_relevant_chunks, collection, question, 8
+        )
+
+        if stream:
+            return StreamingResponse(
+                stream_summary_with_citations(
+                    relevant_chunks, query=question,
+                    on_complete=lambda r: _cache_query_result(
+                        cache_key, collection_id, question, r
+                    )
+                ),
+                media_type="text/event-stream"
+            )
+
+        result = await generate_summary_with_citations(relevant_chunks, query=question)
+
+        await asyncio.to_thread(
+            _cache_query_result, cache_key, collection_id, question, result
+        )
         logger.info(f"✓ Query answered for {collection_id}")
         return result
     
@@ -685,38 +1139,80 @@ async def query_paper(collection_id: str, query_data: QueryRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/query_batch/{collection_id}")
+async def query_paper_batch(collection_id: str, batch: BatchQueryRequest):
+    """Answer several questions about the paper in one request
+
+    The questions run concurrently through the same path as /query, so
+    they share the warm retrieval index and both cache layers, and the
+    client pays one round trip instead of one per question. Answers come
+    back in question order; a failed question yields an error entry in
+    its slot rather than failing the whole batch.
+    """
+    if _get_paper(collection_id) is None:
+        raise HTTPException(status_code=404, detail="Collection not found")
+
+    if not batch.questions:
+        raise HTTPException(status_code=400, detail="No questions provided")
+
+    outcomes = await asyncio.gather(
+        *[query_paper(collection_id, QueryRequest(question=q))
+          for q in batch.questions],
+        return_exceptions=True
+    )
+
+    answers = []
+    for question, outcome in zip(batch.questions, outcomes):
+        if isinstance(outcome, Exception):
+            answers.append({'question': question, 'error': str(outcome)})
+        else:
+            # Copy rather than annotate in place: cache hits hand back the
+            # cached dict itself
+            answers.append({**outcome, 'question': question})
+
+    return {'answers': answers, 'total': len(answers)}
+
+
 @app.get("/collections")
 async def list_collections():
     """List all active collections"""
     collections = []
-    for coll_id, data in active_collections.items():
+    for paper in _list_papers():
         collections.append({
-            'id': coll_id,
-            'filename': data['filename'],
-            'upload_time': data['upload_time'],
-            'total_chunks': data['total_chunks'],
-            'metadata': data['metadata'],
-            'quality_score': data.get('quality_score', {})
+            'id': paper['id'],
+            'filename': paper['filename'],
+            'upload_time': paper['upload_time'],
+            'total_chunks': paper['total_chunks'],
+            'metadata': paper['metadata'],
+            'quality_score': paper.get('quality_score', {})
         })
-    
+
     return {'collections': collections, 'total': len(collections)}
 
 
 @app.delete("/collection/{collection_id}")
 async def delete_collection(collection_id: str):
     """Delete a collection"""
-    if collection_id not in active_collections:
+    paper = _get_paper(collection_id)
+    if paper is None:
         raise HTTPException(status_code=404, detail="Collection not found")
-    
+
     try:
         chroma_client.delete_collection(collection_id)
-        
-        file_path = Path(active_collections[collection_id].get('file_path', ''))
+
+        # Drop cached answers tied to this paper
+        try:
+            query_cache_collection.delete(where={"collection_id": collection_id})
+        except Exception as e:
+            logger.warning(f"Query cache invalidation failed: {e}")
+        _exact_query_cache.pop(collection_id, None)
+
+        file_path = Path(paper.get('file_path', ''))
         if file_path.exists():
             file_path.unlink()
-        
-        del active_collections[collection_id]
-        
+
+        _delete_paper(collection_id)
+
         logger.info(f"✓ Collection deleted: {collection_id}")
         return {"message": "Collection deleted successfully"}
     
@@ -740,7 +1236,7 @@ async def health_check():
             "status": "healthy",
             "message": "AI Research Assistant API is running",
             "ollama_status": ollama_status,
-            "active_collections": len(active_collections),
+            "active_collections": _count_papers(),
             "model": DEFAULT_MODEL,
             "features": ["multi-paper-comparison", "quality-scoring", "citation-analysis"]
         }
@@ -3,170 +3,396 @@ Complete test suite for the AI Research Paper Assistant
 Run this after setting up your system
 """
 
+import hashlib
+import io
+import os
+import random
 import requests
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 
+try:
+    import orjson
+    _loads = orjson.loads  # ~3-5x faster than stdlib json on large payloads
+except ImportError:
+    _loads = json.loads
+
 BASE_URL = "http://localhost:8000"
 
+# Maps sha256(pdf bytes) -> collection_id so re-runs can skip the
+# upload+chunk+embed pipeline for a PDF the server already holds.
+# Set SCHOLARSYNC_TEST_NOCACHE=1 to force a fresh upload (e.g. in CI).
+UPLOAD_CACHE_PATH = Path('.test_cache.json')
+
+class _MockResponse:
+    """Minimal stand-in for requests.Response carrying canned JSON."""
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = json.dumps(payload or {}).encode()
+
+
+class _MockSession:
+    """In-process fake of the API surface for --mock runs.
+
+    Returns schema-matching canned responses for every endpoint the
+    suite touches, so a CI run verifies status codes and response
+    shapes in milliseconds without a server, embedder, or LLM behind
+    it. Implemented on the stdlib rather than responses/respx, which
+    aren't dependencies of this project.
+    """
+
+    _ANSWER = {
+        'summary': 'The paper proposes a method and evaluates it [Page 2].',
+        'cited_pages': [1, 2],
+        'confidence': 0.9,
+    }
+
+    def request(self, method, url, **kwargs):
+        path = url[len(BASE_URL):]
+        if method == 'GET' and path == '/health':
+            return _MockResponse(200, {'status': 'healthy'})
+        if method == 'GET' and path == '/collections':
+            return _MockResponse(200, {'collections': [], 'total': 0})
+        if method == 'POST' and path == '/upload':
+            files = kwargs.get('files')
+            if files and not files['file'][0].endswith('.pdf'):
+                return _MockResponse(400, {'detail': 'Only PDF files allowed'})
+            return _MockResponse(200, {'collection_id': 'doc_stub', 'total_chunks': 7})
+        if method == 'POST' and path.startswith('/summarize/'):
+            if path.endswith('/fake_id_12345'):
+                return _MockResponse(404, {'detail': 'Collection not found'})
+            return _MockResponse(200, self._ANSWER)
+        if method == 'POST' and path.startswith('/query_batch/'):
+            questions = kwargs['json']['questions']
+            return _MockResponse(200, {
+                'answers': [{**self._ANSWER, 'question': q} for q in questions],
+                'total': len(questions),
+            })
+        if method == 'POST' and path.startswith('/query/'):
+            return _MockResponse(200, self._ANSWER)
+        return _MockResponse(404, {'detail': 'Not found'})
+
+    def close(self):
+        pass
+
+
 class SystemTester:
-    def __init__(self):
+    def __init__(self, mock: bool = False):
         self.test_results = []
-    
+        # Endpoint URLs are fixed for the tester's lifetime; build the
+        # static ones once and keep one formatter per parameterized path
+        self._url_health = f"{BASE_URL}/health"
+        self._url_upload = f"{BASE_URL}/upload"
+        self._url_collections = f"{BASE_URL}/collections"
+        self._url_summarize = lambda cid: f"{BASE_URL}/summarize/{cid}"
+        self._url_query = lambda cid: f"{BASE_URL}/query/{cid}"
+        self._url_query_batch = lambda cid: f"{BASE_URL}/query_batch/{cid}"
+        if mock:
+            self.session = _MockSession()
+            return
+        # One Session for the whole suite: every request reuses the same
+        # keep-alive connection instead of paying a fresh TCP handshake
+        self.session = requests.Session()
+        self.session.mount(
+            "http://",
+            requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=20)
+        )
+
+    def close(self):
+        self.session.close()
+
+    def _request(self, method, url, **kwargs):
+        """Send a request, retrying 429s with exponential backoff.
+
+        Honors Retry-After when the server sends one; otherwise sleeps
+        250ms * 2**attempt plus a little jitter (capped at 30s) so
+        concurrent tests don't retry in lockstep. Any non-429 response
+        is returned immediately for the caller to judge.
+        """
+        response = None
+        for attempt in range(6):
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code != 429:
+                return response
+            delay = float(response.headers.get("Retry-After", 0)) or (
+                min(30, 0.25 * 2 ** attempt) + random.uniform(0, 0.25)
+            )
+            time.sleep(delay)
+        return response
+
     def test_health_check(self):
         """Test if API is running"""
         print("\n📊 Testing: Health Check")
         try:
-            response = requests.get(f"{BASE_URL}/health")
-            assert response.status_code == 200
-            print("✓ Health check passed")
-            return True
-        except Exception as e:
+            response = self._request('GET', self._url_health)
+        except requests.RequestException as e:
             print(f"✗ Health check failed: {e}")
             return False
+        if response.status_code != 200:
+            print(f"✗ Health check failed: status {response.status_code}")
+            return False
+        print("✓ Health check passed")
+        return True
     
-    def test_pdf_upload(self, pdf_path: str):
+    def _load_upload_cache(self) -> dict:
+        if UPLOAD_CACHE_PATH.exists():
+            try:
+                return json.loads(UPLOAD_CACHE_PATH.read_text())
+            except (ValueError, OSError):
+                pass
+        return {}
+
+    def _cached_collection_id(self, pdf_key: str):
+        """Return a cached collection_id if the server still has it."""
+        if os.environ.get('SCHOLARSYNC_TEST_NOCACHE'):
+            return None
+        cached_id = self._load_upload_cache().get(pdf_key)
+        if not cached_id:
+            return None
+        response = self._request('GET', self._url_collections)
+        if response.status_code != 200:
+            return None
+        ids = {c['id'] for c in _loads(response.content).get('collections', [])}
+        return cached_id if cached_id in ids else None
+
+    def _save_upload_cache(self, pdf_key: str, collection_id: str):
+        if os.environ.get('SCHOLARSYNC_TEST_NOCACHE'):
+            return
+        cache = self._load_upload_cache()
+        cache[pdf_key] = collection_id
+        UPLOAD_CACHE_PATH.write_text(json.dumps(cache))
+
+    def _upload_pdf(self, filename: str, pdf_bytes: bytes):
+        """POST a PDF to /upload, streaming the multipart body when possible.
+
+        requests' files= builds the whole multipart body in memory as a
+        second copy of the PDF; requests-toolbelt's MultipartEncoder
+        streams it from the buffer in chunks instead. Falls back to the
+        plain form when the toolbelt isn't installed.
+        """
+        try:
+            from requests_toolbelt.multipart.encoder import MultipartEncoder
+        except ImportError:
+            files = {'file': (filename, pdf_bytes, 'application/pdf')}
+            return self._request('POST', self._url_upload, files=files)
+
+        encoder = MultipartEncoder(
+            fields={'file': (filename, io.BytesIO(pdf_bytes), 'application/pdf')}
+        )
+        return self._request(
+            'POST', self._url_upload,
+            data=encoder, headers={'Content-Type': encoder.content_type}
+        )
+
+    def test_pdf_upload(self, pdf_bytes: bytes, pdf_name: str):
         """Test PDF upload and processing"""
-        print(f"\n📊 Testing: PDF Upload - {pdf_path}")
+        print(f"\n📊 Testing: PDF Upload - {pdf_name}")
+        # Re-running the suite against the same PDF skips the
+        # multi-second upload+embed pipeline if the server still
+        # has the collection from a previous run
+        pdf_key = hashlib.sha256(pdf_bytes).hexdigest()
+        cached_id = self._cached_collection_id(pdf_key)
+        if cached_id:
+            print(f"✓ Reusing cached collection: {cached_id}")
+            return cached_id
+
         try:
-            with open(pdf_path, 'rb') as f:
-                files = {'file': f}
-                response = requests.post(f"{BASE_URL}/upload", files=files)
-            
-            assert response.status_code == 200
-            data = response.json()
-            
-            assert 'collection_id' in data
-            assert 'total_chunks' in data
-            assert data['total_chunks'] > 0
-            
-            print(f"✓ Upload successful")
-            print(f"  Collection ID: {data['collection_id']}")
-            print(f"  Chunks: {data['total_chunks']}")
-            
-            return data['collection_id']
-        except Exception as e:
+            response = self._upload_pdf(pdf_name, pdf_bytes)
+        except requests.RequestException as e:
             print(f"✗ Upload failed: {e}")
             return None
+
+        if response.status_code != 200:
+            print(f"✗ Upload failed: status {response.status_code}")
+            return None
+
+        data = _loads(response.content)
+        if 'collection_id' not in data or not data.get('total_chunks'):
+            print(f"✗ Upload failed: malformed response {data}")
+            return None
+
+        print(f"✓ Upload successful")
+        print(f"  Collection ID: {data['collection_id']}")
+        print(f"  Chunks: {data['total_chunks']}")
+
+        self._save_upload_cache(pdf_key, data['collection_id'])
+        return data['collection_id']
     
     def test_summarization(self, collection_id: str):
         """Test summary generation"""
         print(f"\n📊 Testing: Summarization")
         try:
-            response = requests.post(f"{BASE_URL}/summarize/{collection_id}")
-            assert response.status_code == 200
-            
-            data = response.json()
-            assert 'summary' in data
-            assert 'cited_pages' in data
-            assert len(data['summary']) > 0
-            
-            print(f"✓ Summary generated")
-            print(f"  Length: {len(data['summary'])} chars")
-            print(f"  Citations: {len(data['cited_pages'])} pages")
-            print(f"  Cited Pages: {data['cited_pages']}")
-            print(f"\n  Summary Preview:\n  {data['summary'][:200]}...")
-            
-            return data
-        except Exception as e:
+            response = self._request('POST', self._url_summarize(collection_id))
+        except requests.RequestException as e:
             print(f"✗ Summarization failed: {e}")
             return None
+
+        if response.status_code != 200:
+            print(f"✗ Summarization failed: status {response.status_code}")
+            return None
+
+        data = _loads(response.content)
+        if not data.get('summary') or 'cited_pages' not in data:
+            print(f"✗ Summarization failed: malformed response")
+            return None
+
+        print(f"✓ Summary generated")
+        print(f"  Length: {len(data['summary'])} chars")
+        print(f"  Citations: {len(data['cited_pages'])} pages")
+        print(f"  Cited Pages: {data['cited_pages']}")
+        print(f"\n  Summary Preview:\n  {data['summary'][:200]}...")
+
+        return data
     
     def test_query(self, collection_id: str, question: str):
         """Test question answering"""
         print(f"\n📊 Testing: Query - '{question}'")
         try:
-            response = requests.post(
-                f"{BASE_URL}/query/{collection_id}",
+            response = self._request(
+                'POST', self._url_query(collection_id),
                 json={'question': question}
             )
-            assert response.status_code == 200
-            
-            data = response.json()
-            assert 'summary' in data
-            assert len(data['summary']) > 0
-            
-            print(f"✓ Query answered")
-            print(f"  Citations: {len(data['cited_pages'])} pages")
-            print(f"  Cited Pages: {data['cited_pages']}")
-            print(f"\n  Answer Preview:\n  {data['summary'][:200]}...")
-            
-            return data
-        except Exception as e:
+        except requests.RequestException as e:
             print(f"✗ Query failed: {e}")
             return None
+
+        if response.status_code != 200:
+            print(f"✗ Query failed: status {response.status_code}")
+            return None
+
+        data = _loads(response.content)
+        if not data.get('summary'):
+            print(f"✗ Query failed: empty summary")
+            return None
+
+        print(f"✓ Query answered")
+        print(f"  Citations: {len(data['cited_pages'])} pages")
+        print(f"  Cited Pages: {data['cited_pages']}")
+        print(f"\n  Answer Preview:\n  {data['summary'][:200]}...")
+
+        return data
     
+    def test_query_batch(self, collection_id: str, questions: list):
+        """Test batched question answering"""
+        print(f"\n📊 Testing: Batch Query - {len(questions)} questions")
+        try:
+            response = self._request(
+                'POST', self._url_query_batch(collection_id),
+                json={'questions': questions}
+            )
+        except requests.RequestException as e:
+            print(f"✗ Batch query failed: {e}")
+            return None
+
+        if response.status_code != 200:
+            print(f"✗ Batch query failed: status {response.status_code}")
+            return None
+
+        data = _loads(response.content)
+        if len(data.get('answers', [])) != len(questions):
+            print(f"✗ Batch query failed: expected {len(questions)} answers")
+            return None
+
+        for answer in data['answers']:
+            if 'error' in answer:
+                print(f"✗ Question failed: '{answer['question']}': {answer['error']}")
+                return None
+            print(f"✓ Answered: '{answer['question']}'")
+            print(f"  Citations: {len(answer['cited_pages'])} pages")
+
+        return data
+
     def test_invalid_file(self):
         """Test with invalid file type"""
         print(f"\n📊 Testing: Invalid File Upload")
         try:
-            # Create a dummy text file
-            with open('/tmp/test.txt', 'w') as f:
-                f.write("This is not a PDF")
-            
-            with open('/tmp/test.txt', 'rb') as f:
-                files = {'file': ('test.txt', f)}
-                response = requests.post(f"{BASE_URL}/upload", files=files)
-            
-            assert response.status_code == 400
-            print("✓ Invalid file correctly rejected")
-            return True
-        except Exception as e:
+            # The payload never needs to touch disk; an in-memory buffer
+            # keeps the test hermetic (no /tmp dependency, nothing left behind)
+            buf = io.BytesIO(b"This is not a PDF")
+            files = {'file': ('test.txt', buf, 'text/plain')}
+            response = self._request('POST', self._url_upload, files=files)
+        except requests.RequestException as e:
             print(f"✗ Invalid file test failed: {e}")
             return False
+
+        if response.status_code != 400:
+            print(f"✗ Invalid file test failed: status {response.status_code}")
+            return False
+        print("✓ Invalid file correctly rejected")
+        return True
     
     def test_nonexistent_collection(self):
         """Test with nonexistent collection ID"""
         print(f"\n📊 Testing: Nonexistent Collection")
         try:
-            response = requests.post(f"{BASE_URL}/summarize/fake_id_12345")
-            assert response.status_code == 404
-            print("✓ Nonexistent collection correctly handled")
-            return True
-        except Exception as e:
+            response = self._request('POST', self._url_summarize('fake_id_12345'))
+        except requests.RequestException as e:
             print(f"✗ Nonexistent collection test failed: {e}")
             return False
+
+        if response.status_code != 404:
+            print(f"✗ Nonexistent collection test failed: status {response.status_code}")
+            return False
+        print("✓ Nonexistent collection correctly handled")
+        return True
     
     def run_full_test_suite(self, pdf_path: str):
         """Run complete test suite"""
+        try:
+            self._run_full_test_suite(pdf_path)
+        finally:
+            self.close()
+
+    def _run_full_test_suite(self, pdf_path: str):
         print("\n" + "="*60)
         print("🧪 STARTING FULL TEST SUITE")
         print("="*60)
-        
+
         start_time = time.time()
-        
+
         # Test 1: Health Check
         health_ok = self.test_health_check()
         if not health_ok:
             print("\n❌ Cannot proceed - API is not running")
             return
         
-        # Test 2: Invalid File
-        self.test_invalid_file()
-        
-        # Test 3: Nonexistent Collection
-        self.test_nonexistent_collection()
-        
-        # Test 4: Valid PDF Upload
-        collection_id = self.test_pdf_upload(pdf_path)
+        # Tests 2+3: the negative-path probes share no state, so overlap
+        # their socket waits; both reuse pooled connections
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(
+                lambda test: test(),
+                [self.test_invalid_file, self.test_nonexistent_collection]
+            ))
+
+        # Test 4: Valid PDF Upload. Read the file once; the same buffer
+        # serves the cache-key hash and the multipart body
+        pdf_bytes = Path(pdf_path).read_bytes()
+        collection_id = self.test_pdf_upload(pdf_bytes, Path(pdf_path).name)
         if not collection_id:
             print("\n❌ Cannot proceed - PDF upload failed")
             return
         
-        # Test 5: Summarization
-        summary_result = self.test_summarization(collection_id)
-        
-        # Test 6: Multiple Queries
+        # Tests 5+6: Summarization and Queries
         test_questions = [
             "What is the main objective of this paper?",
             "What methodology was used?",
             "What are the key findings?"
         ]
-        
-        for question in test_questions:
-            self.test_query(collection_id, question)
-            time.sleep(1)  # Avoid overwhelming the system
+
+        # The questions go to the server as one /query_batch call so the
+        # client pays a single round trip; summarization is an
+        # independent read on the same collection, so it overlaps the
+        # batch in the pool.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            summary_future = executor.submit(self.test_summarization, collection_id)
+            batch_future = executor.submit(
+                self.test_query_batch, collection_id, test_questions
+            )
+            summary_result = summary_future.result()
+            batch_future.result()
         
         # Final Report
         end_time = time.time()
@@ -185,11 +411,30 @@ class SystemTester:
 
 # Example usage
 if __name__ == "__main__":
+    import argparse
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="ScholarSync system tests")
+    parser.add_argument('pdf', nargs='?', help="Path to a test PDF file")
+    parser.add_argument('--mock', action='store_true',
+                        help="Run against canned responses instead of a live server")
+    args = parser.parse_args()
+
+    if args.mock:
+        # Exercise the HTTP surface against the in-process mock; no
+        # server, PDF, or model needed, and the upload cache stays clean
+        os.environ['SCHOLARSYNC_TEST_NOCACHE'] = '1'
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as tmp:
+            tmp.write(b"%PDF-1.4 mock")
+            tmp.flush()
+            SystemTester(mock=True).run_full_test_suite(tmp.name)
+        raise SystemExit(0)
+
     tester = SystemTester()
-    
+
     # You need to provide a test PDF path
-    test_pdf = input("Enter path to a test PDF file: ")
-    
+    test_pdf = args.pdf or input("Enter path to a test PDF file: ")
+
     if Path(test_pdf).exists():
         tester.run_full_test_suite(test_pdf)
     else: